@@ -0,0 +1,239 @@
+"""
+This file contains the engine. It is responsible for:
+ - scoring a GameState
+ - searching for the best move (negamax with alpha-beta pruning, deepened iteratively until time runs out)
+ - analysing a position: the best few lines (multi-PV) with their scores, under a time or node budget
+ - remembering its transposition table and history heuristic between the moves of a game (Engine)
+"""
+
+import random
+import time
+
+piece_score = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+CHECKMATE = 1000
+STALEMATE = 0
+MAX_DEPTH = 3
+MAX_TABLE_SIZE = 10 ** 6  # transposition table entries, cleared when full
+EXACT, LOWER, UPPER = 0, 1, 2  # what a stored score is: exact, or a bound from a cutoff
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchLimits:
+    '''
+    When a search has to stop, and how many nodes it has visited so far. The deadline can be moved and stop()
+    called from another thread, which is how pondering turns into a timed search
+    '''
+    def __init__(self, time_limit=None, max_nodes=None):
+        self.deadline = None if time_limit is None else time.perf_counter() + time_limit
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def count_node(self):
+        self.nodes += 1
+        if self.stopped:
+            raise SearchTimeout
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SearchTimeout
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise SearchTimeout
+
+
+class Engine:
+    '''
+    The search, plus what it learns along the way. Use one Engine per game: positions searched for one move are
+    often searched again for the next (the opponent usually plays the expected reply), so the transposition table
+    and history heuristic are kept while the move log carries on from the one they were built on
+    '''
+    def __init__(self, max_table_size=MAX_TABLE_SIZE):
+        self.max_table_size = max_table_size
+        self.transposition_table = {}  # position key -> (depth, score, EXACT/LOWER/UPPER, best moveID)
+        self.history = {}  # (piece, end row, end col) -> how often that quiet move caused a cutoff, weighted by depth
+        self.game = []  # coordinate notation of the move log the tables were built on
+
+    def new_game(self):
+        self.transposition_table.clear()
+        self.history.clear()
+        self.game = []
+
+    def sync(self, gs):
+        '''
+        Keep the tables if gs continues the game they were built on, allowing for a different last move (the
+        opponent didn't play the reply we pondered on) or a takeback, else start afresh
+        '''
+        log = [move.get_coordinate_notation() for move in gs.moveLog]
+        shared = min(len(log), len(self.game))
+        common = 0
+        while common < shared and log[common] == self.game[common]:
+            common += 1
+        if common < shared - 1 or (len(log) == 0 and len(self.game) > 1):
+            self.new_game()
+        else:
+            for key in self.history:  # age it, older cutoffs say less about the new position
+                self.history[key] //= 2
+        self.game = log
+
+    def find_best_move(self, gs, valid_moves, max_depth=MAX_DEPTH, time_limit=None, max_nodes=None, limits=None):
+        '''
+        Best move from the deepest search that finished within time_limit seconds / max_nodes nodes (None searches
+        to max_depth). gs is left as it was given, even when the search is cut short
+        '''
+        if len(valid_moves) == 0:
+            return None
+        analysis = self.analyse(gs, valid_moves, 1, max_depth, time_limit, max_nodes, limits)
+        if analysis['depth'] == 0:  # not even depth 1 finished
+            return find_random_move(valid_moves)
+        return analysis['pvs'][0][0]
+
+    def analyse(self, gs, valid_moves, multipv=1, max_depth=MAX_DEPTH, time_limit=None, max_nodes=None, limits=None,
+                report=None):
+        '''
+        The multipv best lines from the deepest search that finished within the budget, as a dict of 'pvs' (lists
+        of Move), 'scores' (for the side to move), 'depth' and 'nodes'. report, if given, is called with that dict
+        after every finished depth
+        '''
+        self.sync(gs)
+        if limits is None:
+            limits = SearchLimits(time_limit, max_nodes)
+        analysis = {'pvs': [], 'scores': [], 'depth': 0, 'nodes': 0}
+        for depth in range(1, max_depth + 1):
+            first_moves = [pv[0] for pv in analysis['pvs']]  # last iteration's best lines are searched first
+            try:
+                results = self.search_root(gs, valid_moves, depth, limits, multipv, first_moves)
+            except SearchTimeout:
+                break
+            analysis['scores'] = [score for score, pv in results]
+            analysis['pvs'] = [pv for score, pv in results]
+            analysis['depth'] = depth
+            analysis['nodes'] = limits.nodes
+            if report is not None:
+                report(analysis)
+        analysis['nodes'] = limits.nodes
+        gs.get_valid_moves()  # searching leaves the checkmate/stalemate flags of the last node visited
+        return analysis
+
+    def search_root(self, gs, valid_moves, depth, limits, multipv=1, first_moves=()):
+        '''
+        (score, pv) of the multipv best root moves, best first. A move only has to beat the current multipv-th best
+        to get an exact score, everything else is cut off as usual
+        '''
+        turn_multiplier = 1 if gs.white_to_move else -1
+        results = []
+        moves = self.order_moves(valid_moves)
+        moves = list(first_moves) + [move for move in moves if move not in first_moves]
+        for move in moves:
+            alpha = results[-1][0] if len(results) >= multipv else -CHECKMATE - 1
+            line = []
+            score = -self.search_move(gs, move, depth - 1, -CHECKMATE - 1, -alpha, -turn_multiplier, limits, line)
+            if len(results) < multipv or score > alpha:
+                results.append((score, [move] + line))
+                results.sort(key=lambda result: -result[0])
+                del results[multipv:]
+        return results
+
+    def search_move(self, gs, move, depth, alpha, beta, turn_multiplier, limits, pv):
+        '''
+        Score of the position after move, from the point of view of the side replying to it
+        '''
+        gs.make_move(move)
+        try:
+            return self.negamax(gs, gs.get_valid_moves(), depth, alpha, beta, turn_multiplier, limits, pv)
+        finally:
+            gs.undo_move()
+
+    def negamax(self, gs, valid_moves, depth, alpha, beta, turn_multiplier, limits, pv):
+        '''
+        Fills pv with the best line found from here
+        '''
+        limits.count_node()
+        if depth == 0 or len(valid_moves) == 0:
+            return turn_multiplier * score_board(gs)
+        key = gs.get_position_key()
+        entry = self.transposition_table.get(key)
+        best_id = None
+        if entry is not None:
+            entry_depth, entry_score, flag, best_id = entry
+            if entry_depth >= depth and (flag == EXACT or (flag == LOWER and entry_score >= beta) or
+                                         (flag == UPPER and entry_score <= alpha)):
+                pv[:] = [move for move in valid_moves if move.moveID == best_id][:1]
+                return entry_score
+        original_alpha = alpha
+        max_score = -CHECKMATE - 1
+        best_move = None
+        for move in self.order_moves(valid_moves, best_id):
+            line = []
+            score = -self.search_move(gs, move, depth - 1, -beta, -alpha, -turn_multiplier, limits, line)
+            if score > max_score:
+                max_score = score
+                best_move = move
+                if score > alpha:
+                    pv[:] = [move] + line
+            if max_score > alpha:
+                alpha = max_score
+            if alpha >= beta:  # opponent won't allow this line, prune
+                if move.piece_captured == '--':
+                    history_key = (move.piece_moved, move.end_row, move.end_col)
+                    self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                break
+        if max_score <= original_alpha:
+            flag = UPPER
+        elif max_score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if len(self.transposition_table) >= self.max_table_size:
+            self.transposition_table.clear()
+        self.transposition_table[key] = (depth, max_score, flag, best_move.moveID)
+        return max_score
+
+    def order_moves(self, valid_moves, best_id=None):
+        '''
+        Best move from the transposition table, then captures (most valuable victim first), then quiet moves by
+        history. Alpha-beta prunes far more when good moves are tried early
+        '''
+        history = self.history
+        return sorted(valid_moves, key=lambda move: (move.moveID != best_id,
+                                                     -piece_score.get(move.piece_captured[1], 0),
+                                                     -history.get((move.piece_moved, move.end_row, move.end_col), 0)))
+
+
+def find_random_move(valid_moves):
+    return valid_moves[random.randint(0, len(valid_moves) - 1)]
+
+
+def find_best_move(gs, valid_moves, max_depth=MAX_DEPTH, time_limit=None, max_nodes=None):
+    '''
+    One-off search with fresh tables, see Engine.find_best_move
+    '''
+    return Engine().find_best_move(gs, valid_moves, max_depth, time_limit, max_nodes)
+
+
+def analyse(gs, valid_moves, multipv=1, max_depth=MAX_DEPTH, time_limit=None, max_nodes=None):
+    '''
+    One-off analysis with fresh tables, see Engine.analyse
+    '''
+    return Engine().analyse(gs, valid_moves, multipv, max_depth, time_limit, max_nodes)
+
+
+def score_board(gs):
+    '''
+    Positive is good for white, negative is good for black
+    '''
+    if gs.checkmate:
+        return -CHECKMATE if gs.white_to_move else CHECKMATE
+    if gs.stalemate:
+        return STALEMATE
+    score = 0
+    for row in gs.board:
+        for square in row:
+            if square[0] == 'w':
+                score += piece_score[square[1]]
+            elif square[0] == 'b':
+                score -= piece_score[square[1]]
+    return score
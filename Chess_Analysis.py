@@ -0,0 +1,147 @@
+"""
+This file annotates positions and games in bulk, e.g. overnight. It:
+ - reads a stream with one FEN, or one game as coordinate moves from the start position ('e2e4 e7e5 ...'), per line
+ - runs the engine for the best K lines (multi-PV) of every position, under a node and/or time budget
+ - writes one JSON record per position as soon as it is done: fen, pvs, scores, depth, nodes, nps, or
+   fen and error when the position can't be analysed (e.g. an invalid FEN), so one bad line doesn't stop the run
+ - spreads positions over a process pool, keeping only a bounded number in flight so input can be any size
+ - resumes: records already in the output file are skipped when run again with --resume (error records are retried)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from Chess import Chess_AI, Chess_Logic
+
+MAX_SEARCH_DEPTH = 64  # with a time or node budget, searches deepen until the budget runs out
+
+
+def read_tasks(lines):
+    '''
+    Yield (id, fen, move played) for every position in the input. Ids are 'line:ply', stable between runs
+    '''
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '/' in line:  # FEN
+            yield '%d:0' % line_number, line, None
+            continue
+        gs = Chess_Logic.GameState()
+        for ply, notation in enumerate(line.split()):
+            fen = gs.get_fen()
+            move = gs.get_move_from_notation(notation)
+            if move is None:
+                print('line %d: illegal move %s, skipping the rest of the game' % (line_number, notation),
+                      file=sys.stderr)
+                break
+            yield '%d:%d' % (line_number, ply), fen, notation
+            gs.make_move(move)
+
+
+def analyse_position(task, multipv, max_depth, time_limit, max_nodes):
+    '''
+    Runs in a pool worker. The JSON record for one position
+    '''
+    task_id, fen, played = task
+    gs = Chess_Logic.GameState()
+    gs.load_fen(fen)
+    start = time.perf_counter()
+    analysis = Chess_AI.analyse(gs, gs.get_valid_moves(), multipv, max_depth, time_limit, max_nodes)
+    elapsed = time.perf_counter() - start
+    record = {'id': task_id, 'fen': fen,
+              'pvs': [[move.get_coordinate_notation() for move in pv] for pv in analysis['pvs']],
+              'scores': analysis['scores'], 'depth': analysis['depth'], 'nodes': analysis['nodes'],
+              'nps': round(analysis['nodes'] / elapsed) if elapsed > 0 else 0, 'time': round(elapsed, 3)}
+    if played is not None:
+        record['played'] = played
+    return record
+
+
+def load_checkpoint(path):
+    '''
+    Ids already written to path without an error. A record cut off half way by a crash is dropped from the file
+    '''
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+            if 'error' not in record:
+                done.add(record['id'])
+        except (ValueError, KeyError):
+            pass
+    return done
+
+
+def run(lines, out, multipv=3, max_depth=None, time_limit=None, max_nodes=None, workers=None, done=()):
+    '''
+    Analyse every position in lines not in done, writing records to out as they finish (in completion order).
+    Without max_depth, searches are bounded by the time or node budget, or go to Chess_AI.MAX_DEPTH if there is none
+    '''
+    if max_depth is None:
+        max_depth = MAX_SEARCH_DEPTH if time_limit is not None or max_nodes is not None else Chess_AI.MAX_DEPTH
+    workers = workers or os.cpu_count() or 1
+    in_flight = set()
+    tasks = {}  # future -> task, to name the position in an error record
+    with ProcessPoolExecutor(workers) as pool:
+        for task in read_tasks(lines):
+            if task[0] in done:
+                continue
+            if len(in_flight) >= 2 * workers:  # don't read further ahead than the pool can use
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_records(finished, tasks, out)
+            future = pool.submit(analyse_position, task, multipv, max_depth, time_limit, max_nodes)
+            tasks[future] = task
+            in_flight.add(future)
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            write_records(finished, tasks, out)
+
+
+def write_records(futures, tasks, out):
+    for future in futures:
+        task_id, fen, played = tasks.pop(future)
+        try:
+            record = future.result()
+        except Exception as error:  # a bad position is reported in its record instead of ending the run
+            print('%s: %s' % (task_id, error), file=sys.stderr)
+            record = {'id': task_id, 'fen': fen, 'error': str(error)}
+        out.write(json.dumps(record) + '\n')
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-PV analysis of positions or games, written as JSONL')
+    parser.add_argument('input', help="one FEN or one game of coordinate moves per line, '-' for stdin")
+    parser.add_argument('output', help='JSONL file to write, appended to with --resume')
+    parser.add_argument('--multipv', type=int, default=3)
+    parser.add_argument('--depth', type=int, default=None,
+                        help='defaults to no limit with --time or --nodes, %d otherwise' % Chess_AI.MAX_DEPTH)
+    parser.add_argument('--time', type=float, default=None, help='seconds per position')
+    parser.add_argument('--nodes', type=int, default=None, help='nodes per position')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--resume', action='store_true', help='skip positions already in output')
+    args = parser.parse_args()
+    done = load_checkpoint(args.output) if args.resume else set()
+    lines = sys.stdin if args.input == '-' else open(args.input)
+    try:
+        with open(args.output, 'a' if args.resume else 'w') as out:
+            run(lines, out, args.multipv, args.depth, args.time, args.nodes, args.workers, done)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+if __name__ == '__main__':
+    main()
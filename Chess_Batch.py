@@ -0,0 +1,122 @@
+"""
+This file generates legal moves for many independent positions at once, for building datasets. It:
+ - takes positions as FEN strings
+ - returns every legal move as one flat array plus per-position offsets (CSR style), so position i owns
+   moves[offsets[i]:offsets[i + 1]]
+ - splits the positions into chunks and spreads them over a process pool
+ - skips invalid positions instead of failing the batch: they get no moves and are reported by index
+
+Moves are packed into 16 bits: start square | end square << 6 | flags << 12, squares numbered row * 8 + col
+with row 0 being rank 8, as on GameState.board.
+"""
+
+import argparse
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import Chess_Logic
+
+PROMOTION, EN_PASSANT, CASTLE = 1, 2, 4  # move flags
+CHUNK_SIZE = 2048
+
+worker_state = None  # one GameState per worker process, loaded with each position in turn
+
+
+def encode_move(move):
+    flags = (PROMOTION if move.is_pawn_promotion else 0) | (EN_PASSANT if move.enPassant else 0) | \
+        (CASTLE if move.is_castle_move else 0)
+    return (move.start_row * 8 + move.start_col) | (move.end_row * 8 + move.end_col) << 6 | flags << 12
+
+
+def decode_move(code):
+    '''
+    (start square, end square, flags) of a packed move, squares as (row, col)
+    '''
+    start, end = code & 63, (code >> 6) & 63
+    return (start // 8, start % 8), (end // 8, end % 8), code >> 12
+
+
+def move_to_notation(code):
+    (start_row, start_col), (end_row, end_col), flags = decode_move(code)
+    notation = Chess_Logic.Move.cols_to_files[start_col] + Chess_Logic.Move.rows_to_ranks[start_row] + \
+        Chess_Logic.Move.cols_to_files[end_col] + Chess_Logic.Move.rows_to_ranks[end_row]
+    return notation + 'q' if flags & PROMOTION else notation
+
+
+def legal_moves_chunk(fens):
+    '''
+    Legal moves of every position in fens, as (moves, offsets) arrays, plus (index, error) of the invalid ones.
+    Runs in a pool worker
+    '''
+    global worker_state
+    if worker_state is None:
+        worker_state = Chess_Logic.GameState()
+    gs = worker_state
+    moves = array('H')
+    offsets = array('I', [0])
+    invalid = []
+    for i, fen in enumerate(fens):
+        try:
+            gs.load_fen(fen)
+        except ValueError as error:
+            invalid.append((i, str(error)))
+        else:
+            moves.extend([encode_move(move) for move in gs.get_valid_moves()])
+        offsets.append(len(moves))
+    return moves, offsets, invalid
+
+
+def batch_legal_moves(fens, workers=None, chunk_size=CHUNK_SIZE):
+    '''
+    Legal moves of every position in fens as (moves, offsets), in the order the positions were given, plus
+    {index: error} of the positions that couldn't be loaded (they own an empty range of moves).
+    workers=0 runs everything in this process
+    '''
+    chunks = [fens[i:i + chunk_size] for i in range(0, len(fens), chunk_size)]
+    if workers == 0:
+        results = map(legal_moves_chunk, chunks)
+    else:
+        pool = ProcessPoolExecutor(workers)
+        results = pool.map(legal_moves_chunk, chunks)
+    moves = array('H')
+    offsets = array('I', [0])
+    invalid = {}
+    try:
+        for chunk_moves, chunk_offsets, chunk_invalid in results:
+            base = len(moves)
+            invalid.update((len(offsets) - 1 + i, error) for i, error in chunk_invalid)
+            moves.extend(chunk_moves)
+            offsets.extend(base + offset for offset in chunk_offsets[1:])
+    finally:
+        if workers != 0:
+            pool.shutdown()
+    return moves, offsets, invalid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Legal moves for every FEN in a file, one position per line')
+    parser.add_argument('fens')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--out', help='write the moves and offsets arrays to OUT.moves and OUT.offsets')
+    args = parser.parse_args()
+    with open(args.fens) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    start = time.perf_counter()
+    moves, offsets, invalid = batch_legal_moves(fens, args.workers, args.chunk_size)
+    elapsed = time.perf_counter() - start
+    for i, error in sorted(invalid.items()):
+        print('position %d: %s' % (i + 1, error), file=sys.stderr)
+    print('%d positions, %d moves in %.2fs (%.0f positions/s)' % (len(fens), len(moves), elapsed,
+                                                                  len(fens) / elapsed if elapsed else 0))
+    if args.out:
+        with open(args.out + '.moves', 'wb') as f:
+            moves.tofile(f)
+        with open(args.out + '.offsets', 'wb') as f:
+            offsets.tofile(f)
+
+
+if __name__ == '__main__':
+    main()
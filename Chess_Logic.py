@@ -3,8 +3,34 @@ This file contains the game mechanics. It is responsible for:
  - storing all the data about the current state of a game
  - determining legal moves of the current state
  - keeping a move log (for undo, look back etc.)
+ - optional profiling of the move generation hot paths
 """
 
+import json
+import marshal
+import time
+
+# castling rights packed into 4 bits, one per side/wing
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+ALL_CASTLE_RIGHTS = WKS | WQS | BKS | BQS
+# rights that survive a piece leaving or landing on each square, so a king/rook move (or a rook capture) is one AND
+CASTLE_MASKS = [[ALL_CASTLE_RIGHTS] * 8 for _ in range(8)]
+CASTLE_MASKS[7][4] = ALL_CASTLE_RIGHTS & ~(WKS | WQS)
+CASTLE_MASKS[7][7] = ALL_CASTLE_RIGHTS & ~WKS
+CASTLE_MASKS[7][0] = ALL_CASTLE_RIGHTS & ~WQS
+CASTLE_MASKS[0][4] = ALL_CASTLE_RIGHTS & ~(BKS | BQS)
+CASTLE_MASKS[0][7] = ALL_CASTLE_RIGHTS & ~BKS
+CASTLE_MASKS[0][0] = ALL_CASTLE_RIGHTS & ~BQS
+FEN_CASTLE_RIGHTS = (('K', WKS), ('Q', WQS), ('k', BKS), ('q', BQS))
+# (king, rook) squares each castling right needs, (row, col)
+CASTLE_HOME_SQUARES = {WKS: ((7, 4), (7, 7)), WQS: ((7, 4), (7, 0)), BKS: ((0, 4), (0, 7)), BQS: ((0, 4), (0, 0))}
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, 1), (-2, -1), (2, 1), (2, -1), (1, 2), (1, -2), (-1, 2), (-1, -2))
+KING_STEPS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+SLIDER_DIRECTIONS = {'R': ROOK_DIRECTIONS, 'B': BISHOP_DIRECTIONS, 'Q': KING_STEPS}
+
 
 class Move:  # nested classes could be used, though it is bad practice
 
@@ -58,8 +84,21 @@ class Move:  # nested classes could be used, though it is bad practice
         return self.piece_moved[1] + self.get_rank_file(self.start_row, self.start_col) + \
                             ' -> ' + self.get_rank_file(self.end_row, self.end_col)
 
+    def get_coordinate_notation(self):
+        '''
+        Start and end squares, e.g. 'e2e4' or 'e7e8q'. This is what the server and the other tools send around
+        '''
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        return notation + 'q' if self.is_pawn_promotion else notation
+
 
 class GameState:
+    # hot paths that Profiler can hook into, per-piece generators included
+    profiled_functions = ('get_valid_moves', 'get_poss_moves', 'check_for_pins_and_checks', 'make_move', 'undo_move',
+                          'get_pawn_moves', 'get_rook_moves', 'get_bishop_moves', 'get_knight_moves',
+                          'get_queen_moves', 'get_king_moves', 'get_castle_moves', 'get_enemy_attacks',
+                          'get_checks_from_last_move')
+
     def __init__(self):  # constructor
         # the board is an 8x8 2D list, each element has 2 chars. char1 = colour (b, w), char2 = piece (K,Q,R,N,B,P)
         # '--' represents an empty square with no piece
@@ -81,20 +120,137 @@ class GameState:
         self.moveLog = []
         self.checks = []
         self.pins = []
+        self.attacked_squares = set()  # squares the side not to move attacks, set by get_valid_moves
         self.white_to_move = True
         self.checkmate = False
         self.stalemate = False
         self.in_check = False
         self.en_passant_is_poss = ()  # coords of square that en-passant would terminate on
-        self.current_castling_right = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-                                               self.current_castling_right.wqs, self.current_castling_right.bqs)]
-        # TODO now log actually keeps track of changes
+        self.current_castling_right = ALL_CASTLE_RIGHTS  # WKS | WQS | BKS | BQS bits
+        self.halfmove_clock = 0  # moves since the last capture or pawn move, for the 50 move rule
+        # everything make_move can't recompute on undo: (castling rights, en-passant square, captured piece, halfmove clock)
+        self.state_log = []
+        self.start_fullmove = 1  # move number the log starts from, for FEN
+
+    def load_fen(self, fen):
+        '''
+        Set up the position described by fen and clear the move log. Reusing one GameState this way is much cheaper
+        than constructing a new one per position
+        '''
+        fields = fen.split()
+        rows = fields[0].split('/') if fields else []
+        if len(rows) != 8 or len(fields) < 2 or fields[1] not in ('w', 'b'):
+            raise ValueError('invalid FEN: ' + fen)
+        board = []
+        kings = {'wK': [], 'bK': []}
+        for r in range(8):
+            row = []
+            for char in rows[r]:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                elif char.upper() in self.move_functions:
+                    row.append(('w' if char.isupper() else 'b') + char.upper())
+                    if row[-1] in kings:
+                        kings[row[-1]].append((r, len(row) - 1))
+                else:
+                    raise ValueError('invalid FEN: ' + fen)
+            if len(row) != 8:
+                raise ValueError('invalid FEN: ' + fen)
+            board.append(row)
+        white_to_move = fields[1] == 'w'
+        en_passant = fields[3] if len(fields) > 3 else '-'
+        # everything is checked before any of it is stored, so a bad FEN leaves the previous position intact
+        if len(kings['wK']) != 1 or len(kings['bK']) != 1 or 'wP' in board[0] + board[7] or \
+                'bP' in board[0] + board[7]:
+            raise ValueError('invalid FEN: ' + fen)
+        en_passant_square = ()
+        if en_passant != '-':
+            # the square behind a pawn that just moved two, so rank 6 with white to move and rank 3 with black
+            if len(en_passant) != 2 or en_passant[0] not in Move.files_to_cols or \
+                    en_passant[1] != ('6' if white_to_move else '3'):
+                raise ValueError('invalid FEN: ' + fen)
+            r, c = Move.ranks_to_rows[en_passant[1]], Move.files_to_cols[en_passant[0]]
+            direction = 1 if white_to_move else -1  # from the en-passant square towards the pawn that moved
+            if board[r + direction][c] != ('b' if white_to_move else 'w') + 'P' or board[r][c] != '--' or \
+                    board[r - direction][c] != '--':
+                raise ValueError('invalid FEN: ' + fen)
+            en_passant_square = (r, c)
+        try:
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            start_fullmove = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError('invalid FEN: ' + fen) from None
+        self.board = board
+        self.white_king_loc = kings['wK'][0]
+        self.black_king_loc = kings['bK'][0]
+        self.white_to_move = white_to_move
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.current_castling_right = 0
+        for char, right in FEN_CASTLE_RIGHTS:
+            (king_row, king_col), (rook_row, rook_col) = CASTLE_HOME_SQUARES[right]
+            colour = 'w' if char.isupper() else 'b'
+            # a right whose king or rook has left home can never be used, so drop it rather than castle without them
+            if char in castling and board[king_row][king_col] == colour + 'K' and \
+                    board[rook_row][rook_col] == colour + 'R':
+                self.current_castling_right |= right
+        self.en_passant_is_poss = en_passant_square
+        self.halfmove_clock = halfmove_clock
+        self.start_fullmove = start_fullmove
+        self.moveLog = []
+        self.state_log = []
+        self.checks = []
+        self.pins = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+
+    def get_fen(self):
+        '''
+        The current position as a FEN string
+        '''
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for square in row:
+                if square == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += square[1] if square[0] == 'w' else square[1].lower()
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ''.join(char for char, right in FEN_CASTLE_RIGHTS if self.current_castling_right & right) or '-'
+        if self.en_passant_is_poss == ():
+            en_passant = '-'
+        else:
+            en_passant = Move.cols_to_files[self.en_passant_is_poss[1]] + Move.rows_to_ranks[self.en_passant_is_poss[0]]
+        # the log may have started on black's move, in which case black's moves are the ones that end a full move
+        started_with_black = len(self.moveLog) % 2 == (1 if self.white_to_move else 0)
+        fullmove = self.start_fullmove + (len(self.moveLog) + started_with_black) // 2
+        return ' '.join(('/'.join(rows), 'w' if self.white_to_move else 'b', castling, en_passant,
+                         str(self.halfmove_clock), str(fullmove)))
+
+    def get_position_key(self):
+        '''
+        Hashable key for the position itself (not how it was reached), e.g. for transposition tables
+        '''
+        return ''.join([''.join(row) for row in self.board]), self.white_to_move, self.current_castling_right, \
+            self.en_passant_is_poss
 
     def make_move(self, move):
         '''
         Takes a move as a parameter and updates it
         '''
+        # save the irreversible state as one tuple, this allows us to undo move
+        self.state_log.append((self.current_castling_right, self.en_passant_is_poss, move.piece_captured,
+                               self.halfmove_clock))
+        if move.piece_moved[1] == 'P' or move.piece_captured != '--':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.board[move.start_row][move.start_col] = "--"  # empty the starting square
 
@@ -130,14 +286,23 @@ class GameState:
                     move.end_col + 1]  # moves the rook
                 self.board[move.end_row][move.end_col + 1] = '--'  # delete old rook
             else:  # queenside castle
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.endcol - 2]  # moves the rook
+                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]  # moves the rook
                 self.board[move.end_row][move.end_col - 2] = '--'  # delete old rook
 
-        # update castling rights whenever king or rook moves
-        self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-                                                   self.current_castling_right.wqs, self.current_castling_right.bqs))
-        # this allows us to undo move
+        # update castling rights whenever a king or rook leaves its square, or a rook is captured on it
+        self.current_castling_right &= CASTLE_MASKS[move.start_row][move.start_col] & \
+            CASTLE_MASKS[move.end_row][move.end_col]
+
+    def get_move_from_notation(self, notation, valid_moves=None):
+        '''
+        The valid move written as notation ('e2e4'), or None if there is no such move in this position
+        '''
+        if valid_moves is None:
+            valid_moves = self.get_valid_moves()
+        for move in valid_moves:
+            if move.get_coordinate_notation() == notation:
+                return move
+        return None
 
     def undo_move(self):
         '''
@@ -145,8 +310,10 @@ class GameState:
         '''
         if len(self.moveLog) != 0:  # ensure there's a move to undo
             move = self.moveLog.pop()
+            self.current_castling_right, self.en_passant_is_poss, piece_captured, self.halfmove_clock = \
+                self.state_log.pop()
             self.board[move.start_row][move.start_col] = move.piece_moved  # put piece on starting square
-            self.board[move.end_row][move.end_col] = move.piece_captured  # put back captured piece
+            self.board[move.end_row][move.end_col] = piece_captured  # put back captured piece
             self.white_to_move = not self.white_to_move  # swap turns back
             # undo kings' moves + update king's position
             if move.piece_moved == 'wK':
@@ -157,16 +324,7 @@ class GameState:
             # undo en-passant move
             if move.enPassant:
                 self.board[move.end_row][move.end_col] = '--'  # leave landing square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured  # puts pawn back in correct square it was captured from
-                self.en_passant_is_poss = (move.end_row, move.end_col)  # crucial - allows enpassant to happen in next move
-            # undo 2 square pawn advance
-            if move.piece_moved[1] == 'P' and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_is_poss = ()
-
-            # undo castling rights
-            self.castle_rights_log.pop()  # delete last element, get rid of castle rights from move being undone
-            new_rights = self.castle_rights_log[-1]
-            self.current_castling_right = CastleRights(new_rights.wks, new_rights.bks, new_rights.wqs, new_rights.bqs)
+                self.board[move.start_row][move.end_col] = piece_captured  # puts pawn back in correct square it was captured from
 
             # undo castle move
             if move.is_castle_move:
@@ -235,7 +393,7 @@ class GameState:
 
         # check if the square in front is empty, we go, if the next too, then we can do 2
         if self.board[r + move_amount][c] == '--':
-            if not piece_pinned or pin_direction == (move_amount, 0):  # can go in direction of pin
+            if not piece_pinned or pin_direction in ((move_amount, 0), (-move_amount, 0)):  # can go along the pin
                 if r + move_amount == back_row:  # promotion
                     is_pawn_promotion = True
                 moves.append(Move((r, c), (r + move_amount, c), self.board, is_pawn_promotion=is_pawn_promotion))
@@ -250,7 +408,8 @@ class GameState:
                         is_pawn_promotion = True
                     moves.append(
                         Move((r, c), (r + move_amount, c - 1), self.board, is_pawn_promotion=is_pawn_promotion))
-                if (r + move_amount, c - 1) == self.en_passant_is_poss:
+                if (r + move_amount, c - 1) == self.en_passant_is_poss and \
+                        self.en_passant_is_legal(r, c, r + move_amount, c - 1):
                     moves.append(Move((r, c), (r + move_amount, c - 1), self.board, is_en_passant=True))
 
         # captures to the right, make sure we don't go off the board
@@ -261,9 +420,27 @@ class GameState:
                         is_pawn_promotion = True
                     moves.append(
                         Move((r, c), (r + move_amount, c + 1), self.board, is_pawn_promotion=is_pawn_promotion))
-                if (r + move_amount, c + 1) == self.en_passant_is_poss:
+                if (r + move_amount, c + 1) == self.en_passant_is_poss and \
+                        self.en_passant_is_legal(r, c, r + move_amount, c + 1):
                     moves.append(Move((r, c), (r + move_amount, c + 1), self.board, is_en_passant=True))
 
+    def en_passant_is_legal(self, r, c, end_row, end_col):
+        '''
+        Play the en-passant capture on the board, see if it leaves our king in check, then take it back. Two pawns
+        leave the same rank at once, so neither the pins nor the check filter can see a king exposed along it
+        '''
+        board = self.board
+        pawn = board[r][c]
+        captured = board[r][end_col]
+        board[r][c] = '--'
+        board[r][end_col] = '--'
+        board[end_row][end_col] = pawn
+        in_check, pins, checks = self.check_for_pins_and_checks()
+        board[r][c] = pawn
+        board[r][end_col] = captured
+        board[end_row][end_col] = '--'
+        return not in_check
+
     def get_king_moves(self, r, c, moves):
         '''
         Get king moves for king located at r, c and add these moves to the list
@@ -277,22 +454,8 @@ class GameState:
             if 0 <= end_row < 8 and 0 <= end_col < 8:  # we are on the board
                 end_piece = self.board[end_row][end_col]
                 if end_piece[0] != ally_colour:  # must be done this way, if same colour and '--', eats own pieces
-                    # poner el rey en la casilla extrema y buscar pinchas y jaques
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
-                    if ally_colour == 'w':
-                        self.white_king_loc = (end_row, end_col)
-                    else:
-                        self.black_king_loc = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
+                    if (end_row, end_col) not in self.attacked_squares:
                         moves.append(Move((r, c), (end_row, end_col), self.board))
-                    # # devolver el rey a su posicion original
-                    if ally_colour == 'w':
-                        self.white_king_loc = (r, c)
-                    else:
-                        self.black_king_loc = (r, c)
-
-        # self.get_castle_moves(r, c, moves, ally_colour) # TODO atm if king not in check, he can move until he is??
 
     def get_rook_moves(self, r, c, moves):
         '''
@@ -304,8 +467,7 @@ class GameState:
             if self.pins[i][0] == r and self.pins[i][1] == c:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q':  # can't remoce queen from pin on rook moves, only on bishop moves
-                    self.pins.remove(self.pins[i])  # TODO comment this to see the difference in bamboozle chess
+                self.pins.remove(self.pins[i])  # TODO comment this to see the difference in bamboozle chess
                 break
 
         directions = ((0, 1), (0, -1), (1, 0), (-1, 0))
@@ -337,7 +499,8 @@ class GameState:
             if self.pins[i][0] == r and self.pins[i][1] == c:
                 piece_pinned = True
                 pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])  # comment this to see the difference in bamboozle
+                if self.board[r][c][1] != 'Q':  # queen calls bishop moves first, leave the pin for its rook moves
+                    self.pins.remove(self.pins[i])  # comment this to see the difference in bamboozle
                 break
         directions = ((1, 1), (-1, -1), (1, -1), (-1, 1))
         enemy_colour = 'b' if self.white_to_move else 'w'
@@ -374,8 +537,7 @@ class GameState:
         for d in destinations:
             end_row = r + d[0]
             end_col = c + d[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:  # we are on the board
-                # if not piece_pinned:
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and not piece_pinned:  # a pinned knight can never move
                 end_piece = self.board[end_row][end_col]
                 if end_piece[0] != ally_colour:
                     moves.append(Move((r, c), (end_row, end_col), self.board))
@@ -391,53 +553,30 @@ class GameState:
         '''
         Generate all valid castle moves for the king at (r,c) then add them to the list
         '''
-        if self.square_under_attack(r, c):
-            print('oof')
+        if (r, c) in self.attacked_squares:
             return  # no pasa nada, can't castle when in check
-        if (self.white_to_move and self.current_castling_right.wks) or (not self.white_to_move and self.current_castling_right.bks):
+        if self.current_castling_right & (WKS if self.white_to_move else BKS):
             self.get_kingside_castle_moves(r, c, moves)
-        if (self.white_to_move and self.current_castling_right.wqs) or (not self.white_to_move and self.current_castling_right.bqs):
+        if self.current_castling_right & (WQS if self.white_to_move else BQS):
             self.get_queenside_castle_moves(r, c, moves)
 
     def get_kingside_castle_moves(self, r, c, moves):
         if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
-            if not self.square_under_attack(r, c + 1) and not self.square_under_attack(r, c + 2):
+            if (r, c + 1) not in self.attacked_squares and (r, c + 2) not in self.attacked_squares:
                 moves.append(Move((r, c), (r, c + 2), self.board, is_castle_move=True))
 
     def get_queenside_castle_moves(self, r, c, moves):
         if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
-            if not self.square_under_attack(r, c - 1) and not self.square_under_attack(r, c - 2):
+            if (r, c - 1) not in self.attacked_squares and (r, c - 2) not in self.attacked_squares:
                 moves.append(Move((r, c), (r, c - 2), self.board, is_castle_move=True))
 
-    def update_castle_rights(self, move):
-        if move.piece_moved == 'wK':
-            self.current_castling_right.wks = False
-            self.current_castling_right.wqs = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_right.bks = False
-            self.current_castling_right.bqs = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_right.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_right.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_right.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_right.bks = False
-
     def get_valid_moves(self):
         '''
         All moves that consider checks (can't know until I know all possible next moves, checking for checks). Filters.
         '''
         # TODO decide on the valid moves function - efficiency vs completeness
         # temp_en_passant = self.en_passant_is_poss  # our copy, tuples are immutable
-        # temp_castle_rights = CastleRights(self.current_castling_right.wks, self.current_castling_right.bks,
-        #                                   self.current_castling_right.wqs,
-        #                                   self.current_castling_right.bqs)  # copy the current castling
+        # temp_castle_rights = self.current_castling_right  # copy the current castling, ints are immutable too
         # # NAIVE WAY
         # # 1. generate all poss moves
         # moves = self.get_poss_moves()
@@ -475,7 +614,13 @@ class GameState:
         # self.en_passant_is_poss = temp_en_passant  # resets. This is to save the value for when we generate moves. only for native way
         # return moves
         moves = []
-        self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()
+        # one pass over the enemy pieces instead of a full check scan for every square the king might go to
+        self.attacked_squares, self.pins = self.get_enemy_attacks()
+        if len(self.moveLog) != 0:
+            self.checks = self.get_checks_from_last_move()
+        else:  # nothing to derive them from, e.g. straight after load_fen
+            in_check, pins, self.checks = self.check_for_pins_and_checks()
+        self.in_check = len(self.checks) != 0
         if self.white_to_move:
             king_row = self.white_king_loc[0]
             king_col = self.white_king_loc[1]
@@ -501,23 +646,24 @@ class GameState:
                         if valid_square[0] == check_row and valid_square[1] == check_col:
                             break
 
-                    # improving efficiency by geting rid of moves that don't block the check or move the king
-                    for i in range(len(moves) - 1, -1, -1):  # backwards through iterations to avoid index shifts
-                        if moves[i].piece_moved[1] != 'K':  # move doesn't move king so it must block or capture?
-                            if not (moves[i].end_row, moves[i].end_col) in valid_squares:  # move doesn't block check or capture piece
+                # improving efficiency by geting rid of moves that don't block the check or move the king
+                for i in range(len(moves) - 1, -1, -1):  # backwards through iterations to avoid index shifts
+                    if moves[i].piece_moved[1] != 'K':  # move doesn't move king so it must block or capture?
+                        if not (moves[i].end_row, moves[i].end_col) in valid_squares:  # move doesn't block check or capture piece
+                            # en-passant lands behind the checking pawn it captures
+                            if not (moves[i].enPassant and (moves[i].start_row, moves[i].end_col) == (check_row, check_col)):
                                 moves.remove(moves[i])
             else:  # double check, king must move
                 self.get_king_moves(king_row, king_col, moves)
         else:  # not in check so all moves are okay
             moves = self.get_poss_moves()
+            self.get_castle_moves(king_row, king_col, moves)
 
         if len(moves) == 0:
             if self.in_check:
                 self.checkmate = True
-                print('DEATH')
             else:
                 self.stalemate = True
-                print('STALEDEATH')
         else:
             self.checkmate = False
             self.stalemate = False
@@ -525,8 +671,7 @@ class GameState:
         # self.get_castle_moves(r, c, moves, ally_colour)
         return moves
 
-
-    # TODO decide which mechanism to use for pins and checks, currently the king ignores checks
+    # full scan from the king, only needed when there is no last move to derive checks from (and for en-passant)
     def check_for_pins_and_checks(self):
         '''
         If player is in check, returns list of pins and checks
@@ -594,31 +739,212 @@ class GameState:
                     checks.append((end_row, end_col, m[0], m[1]))
         return in_check, pins, checks
 
-    def square_under_attack(self, r, c):
+    def get_enemy_attacks(self):
         '''
-        Determine if square (r, c) can be attacked by opponent
+        Every square the enemy attacks, and every allied piece pinned to our king, in one pass over the enemy pieces.
+        Our king is seen through, so it can't step back along the ray of a slider checking it
         '''
-        self.white_to_move = not self.white_to_move  # switch turns
-        opponent_moves = self.get_poss_moves()
-        self.white_to_move = not self.white_to_move  # switch turns back
-        for move in opponent_moves:
-            if move.end_row == r and move.end_col == c:  # square is under attack
-                return True
-        return False
+        attacked = set()
+        pins = []
+        if self.white_to_move:
+            ally_colour, enemy_colour, ally_king, pawn_row = 'w', 'b', 'wK', 1
+        else:
+            ally_colour, enemy_colour, ally_king, pawn_row = 'b', 'w', 'bK', -1
+        board = self.board
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[0] != enemy_colour:
+                    continue
+                kind = piece[1]
+                if kind == 'P':
+                    if 0 <= r + pawn_row < 8:
+                        if c > 0:
+                            attacked.add((r + pawn_row, c - 1))
+                        if c < 7:
+                            attacked.add((r + pawn_row, c + 1))
+                elif kind == 'N' or kind == 'K':
+                    for d in (KNIGHT_JUMPS if kind == 'N' else KING_STEPS):
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked.add((end_row, end_col))
+                else:
+                    for d in SLIDER_DIRECTIONS[kind]:
+                        end_row = r + d[0]
+                        end_col = c + d[1]
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked.add((end_row, end_col))
+                            end_piece = board[end_row][end_col]
+                            if end_piece != '--' and end_piece != ally_king:
+                                if end_piece[0] == ally_colour:  # look behind it, a king there means a pin
+                                    row = end_row + d[0]
+                                    col = end_col + d[1]
+                                    while 0 <= row < 8 and 0 <= col < 8 and board[row][col] == '--':
+                                        row += d[0]
+                                        col += d[1]
+                                    if 0 <= row < 8 and 0 <= col < 8 and board[row][col] == ally_king:
+                                        pins.append((end_row, end_col, -d[0], -d[1]))  # direction from our king
+                                break
+                            end_row += d[0]
+                            end_col += d[1]
+        return attacked, pins
 
-    def in_check(self):  # could put this into get_valid_moves but having it as a separate func allows usage elsewhere
+    def get_checks_from_last_move(self):
         '''
-        Determines if player is in check
+        Checks on the side to move can only come from the last move: the piece that moved (or the rook, when
+        castling), or a slider uncovered by the square it left (or the pawn an en-passant took)
         '''
-        if self.white_to_move:
-            return self.square_under_attack(self.white_king_loc[0], self.white_king_loc[1])
-        else:
-            return self.square_under_attack(self.black_king_loc[0], self.black_king_loc[1])
+        move = self.moveLog[-1]
+        king_row, king_col = self.white_king_loc if self.white_to_move else self.black_king_loc
+        candidates = [(move.end_row, move.end_col)]
+        if move.is_castle_move:
+            candidates.append((move.end_row, move.end_col - 1 if move.end_col > move.start_col else move.end_col + 1))
+        vacated = [(move.start_row, move.start_col)]
+        if move.enPassant:
+            vacated.append((move.start_row, move.end_col))
+        for row, col in vacated:  # discovered checks, the first piece on the line from our king through the square
+            d_row, d_col = row - king_row, col - king_col
+            if d_row == 0 or d_col == 0 or abs(d_row) == abs(d_col):
+                d = ((d_row > 0) - (d_row < 0), (d_col > 0) - (d_col < 0))
+                row, col = king_row + d[0], king_col + d[1]
+                while 0 <= row < 8 and 0 <= col < 8 and self.board[row][col] == '--':
+                    row += d[0]
+                    col += d[1]
+                if 0 <= row < 8 and 0 <= col < 8 and (row, col) not in candidates:
+                    candidates.append((row, col))
+        checks = []
+        for row, col in candidates:
+            check = self.get_check_from(row, col, king_row, king_col)
+            if check is not None:
+                checks.append(check)
+        return checks
+
+    def get_check_from(self, r, c, king_row, king_col):
+        '''
+        The check (r, c, direction from king) if the piece on (r, c) is an enemy giving check, else None
+        '''
+        piece = self.board[r][c]
+        if piece[0] != ('b' if self.white_to_move else 'w'):
+            return None
+        kind = piece[1]
+        d_row, d_col = r - king_row, c - king_col
+        if kind == 'N':
+            return (r, c, d_row, d_col) if (abs(d_row), abs(d_col)) in ((1, 2), (2, 1)) else None
+        if kind == 'P':  # pawns capture towards the other side, so they check from one row in front of the king
+            pawn_row = -1 if self.white_to_move else 1
+            return (r, c, d_row, d_col) if d_row == pawn_row and abs(d_col) == 1 else None
+        if kind == 'K':
+            return None
+        orthogonal = d_row == 0 or d_col == 0
+        if not (orthogonal or abs(d_row) == abs(d_col)) or (kind == 'R' and not orthogonal) or \
+                (kind == 'B' and orthogonal):
+            return None
+        d = ((d_row > 0) - (d_row < 0), (d_col > 0) - (d_col < 0))
+        row, col = king_row + d[0], king_col + d[1]
+        while (row, col) != (r, c):
+            if self.board[row][col] != '--':  # blocked
+                return None
+            row += d[0]
+            col += d[1]
+        return (r, c, d[0], d[1])
+
+    def enable_profiling(self, profiler):
+        '''
+        Route the hot paths through profiler. Wrappers live on this instance only, so unprofiled games pay nothing
+        '''
+        for name in self.profiled_functions:
+            setattr(self, name, profiler.wrap(name, getattr(GameState, name).__get__(self)))
+        self.move_functions = {piece: getattr(self, func.__name__) for piece, func in self.move_functions.items()}
+
+    def disable_profiling(self):
+        '''
+        Remove the profiling wrappers, falling back to the plain class methods
+        '''
+        for name in self.profiled_functions:
+            self.__dict__.pop(name, None)
+        self.move_functions = {piece: getattr(self, func.__name__) for piece, func in self.move_functions.items()}
 
 
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+class Profiler:
+    '''
+    Opt-in call counters and timers for GameState. Use gs.enable_profiling(profiler), play/search, then export with
+    to_json() or dump_stats(), the latter being readable by pstats/snakeviz like a cProfile dump
+    '''
+    def __init__(self):
+        self.stats = {}  # name -> [code key, primitive calls, total calls, self time, cumulative time, callers]
+        self.stack = []  # [name, time spent in profiled callees] for every call in progress
+
+    def wrap(self, name, func):
+        '''
+        Return func wrapped with counting and timing, recorded under name
+        '''
+        code = func.__func__.__code__
+        entry = self.stats.setdefault(name, [(code.co_filename, code.co_firstlineno, name), 0, 0, 0.0, 0.0, {}])
+        stack = self.stack
+        clock = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            caller = stack[-1][0] if stack else None
+            recursive = any(frame[0] == name for frame in stack)  # cumulative time only counts the outermost call
+            frame = [name, 0.0]
+            stack.append(frame)
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                own_time = elapsed - frame[1]
+                entry[2] += 1
+                entry[3] += own_time
+                if not recursive:
+                    entry[1] += 1
+                    entry[4] += elapsed
+                if caller is not None:
+                    edge = entry[5].setdefault(caller, [0, 0, 0.0, 0.0])  # same layout as pstats callers
+                    edge[0] += 1
+                    edge[2] += own_time
+                    if not recursive:
+                        edge[1] += 1
+                        edge[3] += elapsed
+
+        wrapper.__name__ = name
+        return wrapper
+
+    def reset(self):
+        for entry in self.stats.values():
+            entry[1:] = [0, 0, 0.0, 0.0, {}]
+
+    def report(self):
+        '''
+        Counters and timers as a plain dict, slowest (by self time) first
+        '''
+        report = {}
+        for name, (key, primitive_calls, calls, own_time, cumulative_time, callers) in \
+                sorted(self.stats.items(), key=lambda item: -item[1][3]):
+            report[name] = {'calls': calls, 'primitive_calls': primitive_calls, 'self_time': own_time,
+                            'cumulative_time': cumulative_time,
+                            'callers': {caller: edge[0] for caller, edge in callers.items()}}
+        return report
+
+    def to_json(self, path=None):
+        text = json.dumps(self.report(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def dump_stats(self, path):
+        '''
+        Write a cProfile-compatible dump, load it with pstats.Stats(path)
+        '''
+        keys = {name: entry[0] for name, entry in self.stats.items()}
+        stats = {}
+        for name, (key, primitive_calls, calls, own_time, cumulative_time, callers) in self.stats.items():
+            stats[key] = (primitive_calls, calls, own_time, cumulative_time,
+                          {keys[caller]: tuple(edge) for caller, edge in callers.items()})
+        with open(path, 'wb') as f:
+            marshal.dump(stats, f)
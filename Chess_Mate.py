@@ -0,0 +1,181 @@
+"""
+This file proves forced mates, for puzzle verification and cleaning tactics datasets. It:
+ - runs proof-number search on a GameState: the side to move tries to mate, the other side tries to escape
+ - deepens the mate limit one move at a time, so the first proof found is the shortest mate (mate-in-N)
+ - caps the number of tree nodes, answering 'unknown' rather than running out of memory
+ - reports the mating line in coordinate notation
+"""
+
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import Chess_Logic
+
+INFINITY = 10 ** 9
+MAX_MOVES = 5
+MAX_NODES = 200000
+
+
+class Node:
+    __slots__ = ('move', 'parent', 'children', 'is_or', 'pn', 'dn')  # there are a lot of these
+
+    def __init__(self, move, parent, is_or):
+        self.move = move
+        self.parent = parent
+        self.children = None  # None until expanded, [] for a position with no moves
+        self.is_or = is_or  # OR node: attacker to move, one mating move is enough. AND node: every defence must fail
+        self.pn = 1  # proof number, how many leaves still need proving for this to be a mate
+        self.dn = 1  # disproof number, how many leaves still need disproving for this not to be a mate
+
+
+def solve_mate(gs, max_moves=MAX_MOVES, max_nodes=MAX_NODES):
+    '''
+    Look for a mate by the side to move in at most max_moves moves. Returns a dict with 'result' ('mate', 'no mate'
+    or 'unknown' when max_nodes ran out), 'mate_in', 'line' and 'nodes'. gs is left as it was given
+    '''
+    nodes = 0
+    result = {'result': 'no mate', 'mate_in': None, 'line': [], 'nodes': 0}
+    for mate_in in range(1, max_moves + 1):
+        root, used = proof_number_search(gs, 2 * mate_in - 1, max_nodes - nodes)
+        nodes += used
+        if root.pn == 0:
+            result = {'result': 'mate', 'mate_in': mate_in, 'line': mating_line(root), 'nodes': nodes}
+            break
+        if root.dn != 0:  # neither proved nor disproved, out of nodes
+            result = {'result': 'unknown', 'mate_in': None, 'line': [], 'nodes': nodes}
+            break
+    result['nodes'] = nodes
+    gs.get_valid_moves()  # searching leaves the checkmate/stalemate flags of the last node visited
+    return result
+
+
+def proof_number_search(gs, max_plies, max_nodes):
+    '''
+    Proof-number search for a mate delivered within max_plies half-moves. Returns the root and the nodes it used
+    '''
+    root = Node(None, None, True)
+    nodes = 1
+    while root.pn != 0 and root.dn != 0 and nodes < max_nodes:
+        node, plies = select_most_proving(gs, root)
+        nodes += expand(gs, node, plies, max_plies)
+        update_ancestors(gs, node)
+    return root, nodes
+
+
+def select_most_proving(gs, node):
+    '''
+    Walk down to the leaf that most cheaply proves or disproves the root, making the moves on gs along the way
+    '''
+    plies = 0
+    while node.children:
+        if node.is_or:
+            node = min(node.children, key=lambda child: child.pn)
+        else:
+            node = min(node.children, key=lambda child: child.dn)
+        gs.make_move(node.move)
+        plies += 1
+    return node, plies
+
+
+def expand(gs, node, plies, max_plies):
+    '''
+    Create and evaluate the children of node, the position currently on gs. Returns the number of children made
+    '''
+    node.children = []
+    for move in gs.get_valid_moves():
+        child = Node(move, node, not node.is_or)
+        gs.make_move(move)
+        evaluate(gs, child, plies + 1, max_plies)
+        gs.undo_move()
+        node.children.append(child)
+    if len(node.children) == 0:  # only reachable at the root, every other node was evaluated as a child
+        node.pn, node.dn = INFINITY, 0
+    return len(node.children)
+
+
+def evaluate(gs, node, plies, max_plies):
+    replies = gs.get_valid_moves()
+    if len(replies) == 0:
+        if gs.checkmate and not node.is_or:  # defender is mated
+            node.pn, node.dn = 0, INFINITY
+        else:  # attacker mated, or stalemate
+            node.pn, node.dn = INFINITY, 0
+        node.children = []
+    elif plies >= max_plies:  # out of moves to mate in
+        node.pn, node.dn = INFINITY, 0
+        node.children = []
+    elif node.is_or:  # mobility start values: fewer replies is closer to a proof/disproof
+        node.pn, node.dn = 1, len(replies)
+    else:
+        node.pn, node.dn = len(replies), 1
+
+
+def update_ancestors(gs, node):
+    '''
+    Recompute proof and disproof numbers from node up to the root, undoing the moves select_most_proving made
+    '''
+    while True:
+        if node.children:
+            if node.is_or:
+                node.pn = min(child.pn for child in node.children)
+                node.dn = min(INFINITY, sum(child.dn for child in node.children))
+            else:
+                node.pn = min(INFINITY, sum(child.pn for child in node.children))
+                node.dn = min(child.dn for child in node.children)
+        if node.parent is None:
+            return
+        gs.undo_move()
+        node = node.parent
+
+
+def mate_plies(node):
+    '''
+    Length in half-moves of the longest defence against the quickest mate in the proof tree below node
+    '''
+    if not node.children:
+        return 0
+    if node.is_or:
+        return 1 + min(mate_plies(child) for child in node.children if child.pn == 0)
+    return 1 + max(mate_plies(child) for child in node.children)
+
+
+def mating_line(root):
+    line = []
+    node = root
+    while node.children:
+        if node.is_or:
+            node = min((child for child in node.children if child.pn == 0), key=mate_plies)
+        else:
+            node = max(node.children, key=mate_plies)
+        line.append(node.move.get_coordinate_notation())
+    return line
+
+
+def solve_fen(fen, max_moves=MAX_MOVES, max_nodes=MAX_NODES):
+    gs = Chess_Logic.GameState()
+    gs.load_fen(fen)
+    return dict(solve_mate(gs, max_moves, max_nodes), fen=fen)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prove forced mates for every FEN in a file, one per line')
+    parser.add_argument('fens')
+    parser.add_argument('--max-moves', type=int, default=MAX_MOVES)
+    parser.add_argument('--max-nodes', type=int, default=MAX_NODES)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    with open(args.fens) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(solve_fen, fen, args.max_moves, args.max_nodes) for fen in fens]
+        for fen, future in zip(fens, futures):
+            try:
+                result = future.result()
+            except Exception as error:  # e.g. an invalid FEN, report it and carry on with the rest of the file
+                result = {'fen': fen, 'error': str(error)}
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+This file hosts many games from one process. It:
+ - accepts clients over TCP, one JSON message per line in each direction
+ - keeps a GameState per session and validates every move with get_valid_moves
+ - runs engine searches in worker processes, so the event loop never blocks on a search. Each session is pinned to
+   one worker, which keeps the session's Engine (transposition table, history heuristic) between its moves
+ - runs per-session clocks (base time + increment), flagging whoever runs out
+
+Client -> server messages (replies echo 'id' when given):
+    {"op": "new", "white": "human", "black": "engine", "time": 300, "increment": 2}
+    {"op": "move", "game": 1, "move": "e2e4"}
+    {"op": "state", "game": 1}
+    {"op": "resign", "game": 1}
+    {"op": "close", "game": 1}
+Server -> client events: {"event": "move" | "state" | "end" | "error", ...}
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import Chess_AI, Chess_Logic
+
+PLAYERS = ('human', 'engine')
+MAX_LINE = 2 ** 16  # longest message we accept from a client
+ENGINE_TABLE_SIZE = 2 * 10 ** 4  # transposition table entries per session, a worker holds many sessions' tables
+
+worker_engines = {}  # session id -> Engine, in each worker process
+
+
+def engine_search(session_id, history, max_depth, time_limit, table_size=ENGINE_TABLE_SIZE):
+    '''
+    Runs in the worker the session is pinned to. Rebuild the game from its move history and return the engine's move
+    as 'e2e4', searched by the session's Engine so what it learnt on earlier moves is reused
+    '''
+    engine = worker_engines.get(session_id)
+    if engine is None:
+        engine = worker_engines[session_id] = Chess_AI.Engine(table_size)
+    gs = Chess_Logic.GameState()
+    for notation in history:
+        gs.make_move(gs.get_move_from_notation(notation))
+    move = engine.find_best_move(gs, gs.get_valid_moves(), max_depth, time_limit)
+    return move.get_coordinate_notation()
+
+
+def forget_session(session_id):
+    '''
+    Runs in a worker. Drop the Engine of a session that is over
+    '''
+    worker_engines.pop(session_id, None)
+
+
+def is_number(value):
+    '''
+    True for finite ints and floats from a decoded message. json accepts NaN and Infinity, and bools are ints
+    '''
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+class Session:
+    def __init__(self, session_id, connection, white, black, base_time, increment):
+        self.id = session_id
+        self.connection = connection  # the client that created the game gets all of its events
+        self.gs = Chess_Logic.GameState()
+        self.valid_moves = self.gs.get_valid_moves()
+        self.history = []  # coordinate notation of every move, what pool workers replay
+        self.players = {'w': white, 'b': black}
+        self.clocks = {'w': base_time, 'b': base_time}  # seconds left, None when untimed
+        self.increment = increment
+        self.turn_started = None
+        self.flag_timer = None  # fires when the side to move runs out of time
+        self.engine_task = None
+        self.engine_released = False  # whether the worker has been told to drop this session's Engine
+        self.result = None
+        self.reason = None
+
+    def to_move(self):
+        return 'w' if self.gs.white_to_move else 'b'
+
+    def to_dict(self):
+        return {'game': self.id, 'board': [' '.join(row) for row in self.gs.board], 'to_move': self.to_move(),
+                'moves': self.history, 'clocks': self.clocks, 'result': self.result}
+
+
+class Connection:
+    '''
+    One client. Writes go through a lock and wait on drain(), so a slow reader slows its own sessions down
+    instead of growing our buffers
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.write_lock = asyncio.Lock()
+        self.sessions = set()
+
+    async def send(self, message):
+        if self.writer.is_closing():
+            return
+        async with self.write_lock:
+            self.writer.write(json.dumps(message).encode() + b'\n')
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+
+
+class GameServer:
+    def __init__(self, max_sessions=500, workers=None, max_searches=None, engine_depth=Chess_AI.MAX_DEPTH,
+                 engine_time=5.0, engine_table_size=ENGINE_TABLE_SIZE):
+        self.max_sessions = max_sessions
+        workers = workers or os.cpu_count() or 1
+        # one single-process executor per worker rather than one shared pool, so a session's searches always run
+        # where its Engine lives. The price is that a busy worker's sessions can't spill over to an idle one
+        self.pools = [ProcessPoolExecutor(1) for _ in range(workers)]
+        # backpressure on the pool: searches beyond this wait here instead of piling up in the executor queue
+        self.search_slots = asyncio.Semaphore(max_searches or 2 * workers)
+        self.engine_depth = engine_depth
+        self.engine_time = engine_time  # seconds per search cap, before the clock is taken into account
+        self.engine_table_size = engine_table_size
+        self.sessions = {}
+        self.next_id = 1
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8765):
+        # fork the workers before accepting anyone. Forked later, they would inherit the sockets of clients already
+        # connected, and closing a connection here wouldn't close it while a worker still held a copy
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, forget_session, None) for pool in self.pools))
+        self.server = await asyncio.start_server(self.handle_client, host, port, limit=MAX_LINE)
+        return self.server
+
+    async def close(self):
+        for session in list(self.sessions.values()):
+            self.close_session(session)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+
+    async def handle_client(self, reader, writer):
+        connection = Connection(reader, writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):  # line longer than MAX_LINE
+                    await connection.send({'event': 'error', 'error': 'message too long'})
+                    break
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    await connection.send({'event': 'error', 'error': 'invalid JSON'})
+                    continue
+                if not isinstance(message, dict):
+                    await connection.send({'event': 'error', 'error': 'message must be a JSON object'})
+                    continue
+                reply = self.handle_message(connection, message)
+                if 'id' in message:
+                    reply['id'] = message['id']
+                await connection.send(reply)  # one reply in flight per client, never read ahead of our writes
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in list(connection.sessions):
+                self.close_session(self.sessions[session_id])
+            writer.close()
+
+    def handle_message(self, connection, message):
+        op = message.get('op')
+        if op == 'new':
+            return self.new_session(connection, message)
+        session_id = message.get('game')
+        session = self.sessions.get(session_id) if is_number(session_id) else None
+        if session is None or session.connection is not connection:
+            return {'event': 'error', 'error': 'unknown game'}
+        if op == 'state':
+            return dict(session.to_dict(), event='state')
+        if op == 'close':
+            self.close_session(session)
+            return {'event': 'closed', 'game': session.id}
+        if session.result is not None:
+            return {'event': 'error', 'game': session.id, 'error': 'game is over'}
+        if op == 'resign':
+            humans = [colour for colour, player in session.players.items() if player == 'human']
+            colour = humans[0] if len(humans) == 1 else session.to_move()
+            self.end_session(session, '0-1' if colour == 'w' else '1-0', 'resignation')
+            return dict(session.to_dict(), event='end', reason='resignation')
+        if op == 'move':
+            if session.players[session.to_move()] != 'human':
+                return {'event': 'error', 'game': session.id, 'error': 'not your turn'}
+            move = session.gs.get_move_from_notation(message.get('move'), session.valid_moves)
+            if move is None:
+                return {'event': 'error', 'game': session.id, 'error': 'illegal move'}
+            self.play(session, move)
+            if session.result is not None:
+                # handle_client takes the write lock for the move reply before this task first runs, so the end event
+                # follows the move here just as it does after an engine move
+                asyncio.create_task(connection.send(dict(session.to_dict(), event='end', reason=session.reason)))
+            return dict(session.to_dict(), event='move', move=move.get_coordinate_notation())
+        return {'event': 'error', 'error': 'unknown op'}
+
+    def new_session(self, connection, message):
+        if len(self.sessions) >= self.max_sessions:
+            return {'event': 'error', 'error': 'server full'}
+        white = message.get('white', 'human')
+        black = message.get('black', 'engine')
+        if white not in PLAYERS or black not in PLAYERS:
+            return {'event': 'error', 'error': 'players must be one of ' + ', '.join(PLAYERS)}
+        base_time = message.get('time')
+        increment = message.get('increment', 0)
+        if not (base_time is None or is_number(base_time) and base_time > 0) or \
+                not (is_number(increment) and increment >= 0):
+            return {'event': 'error', 'error': 'time must be a positive number and increment a non-negative one'}
+        session = Session(self.next_id, connection, white, black, base_time, increment)
+        self.next_id += 1
+        self.sessions[session.id] = session
+        connection.sessions.add(session.id)
+        self.start_turn(session)
+        return dict(session.to_dict(), event='new')
+
+    def close_session(self, session):
+        self.stop_clock(session)
+        if session.engine_task is not None:
+            session.engine_task.cancel()
+        self.sessions.pop(session.id, None)
+        session.connection.sessions.discard(session.id)
+        self.release_engine(session)
+
+    def pool_for(self, session):
+        return self.pools[session.id % len(self.pools)]
+
+    def release_engine(self, session):
+        '''
+        Free the session's Engine in its worker, once the game is over or closed
+        '''
+        if 'engine' not in session.players.values() or session.engine_released:
+            return
+        session.engine_released = True
+        try:
+            self.pool_for(session).submit(forget_session, session.id)
+        except RuntimeError:  # the worker is broken or shut down, and its engines with it
+            pass
+
+    def start_turn(self, session):
+        '''
+        Start the clock of the side to move and, if it's the engine, start its search
+        '''
+        loop = asyncio.get_running_loop()
+        session.turn_started = loop.time()
+        colour = session.to_move()
+        if session.clocks[colour] is not None:
+            session.flag_timer = loop.call_later(session.clocks[colour], self.flag, session)
+        if session.players[colour] == 'engine':
+            session.engine_task = asyncio.create_task(self.engine_move(session))
+
+    def stop_clock(self, session):
+        if session.flag_timer is not None:
+            session.flag_timer.cancel()
+            session.flag_timer = None
+        colour = session.to_move()
+        if session.clocks[colour] is not None and session.turn_started is not None:
+            elapsed = asyncio.get_running_loop().time() - session.turn_started
+            session.clocks[colour] = max(0.0, session.clocks[colour] - elapsed)
+
+    def flag(self, session):
+        session.flag_timer = None
+        self.end_session(session, '0-1' if session.to_move() == 'w' else '1-0', 'time')
+        asyncio.create_task(session.connection.send(dict(session.to_dict(), event='end', reason='time')))
+
+    def end_session(self, session, result, reason):
+        self.stop_clock(session)
+        if session.engine_task is not None and session.engine_task is not asyncio.current_task():
+            session.engine_task.cancel()
+        session.result = result
+        session.reason = reason
+        self.release_engine(session)
+
+    def play(self, session, move):
+        '''
+        Make a validated move, update the clocks and either finish the game or hand the turn over
+        '''
+        colour = session.to_move()
+        self.stop_clock(session)
+        if session.clocks[colour] is not None:
+            session.clocks[colour] += session.increment
+        session.gs.make_move(move)
+        session.history.append(move.get_coordinate_notation())
+        session.valid_moves = session.gs.get_valid_moves()
+        if session.gs.checkmate:
+            self.end_session(session, '1-0' if colour == 'w' else '0-1', 'checkmate')
+        elif session.gs.stalemate:
+            self.end_session(session, '1/2-1/2', 'stalemate')
+        elif session.gs.halfmove_clock >= 150:  # the 50 move rule is only a claim, 75 moves is an automatic draw
+            self.end_session(session, '1/2-1/2', '75 move rule')
+        else:
+            self.start_turn(session)
+
+    def search_time(self, session):
+        '''
+        Seconds the engine to move may search for: about 1/30 of what's left on its clock plus the increment, but
+        never more than half of what's left, so a big increment can't make it flag
+        '''
+        colour = session.to_move()
+        if session.clocks[colour] is None:
+            return self.engine_time
+        left = session.clocks[colour] - (asyncio.get_running_loop().time() - session.turn_started)
+        return max(0.0, min(self.engine_time, left / 30 + session.increment, left / 2))
+
+    async def engine_move(self, session):
+        try:
+            async with self.search_slots:
+                # only now, the clock has been running while we waited for the slot
+                time_limit = self.search_time(session)
+                notation = await asyncio.get_running_loop().run_in_executor(
+                    self.pool_for(session), engine_search, session.id, list(session.history), self.engine_depth,
+                    time_limit, self.engine_table_size)
+        except Exception as error:  # a crashed worker (BrokenProcessPool) or a failed search, not cancellation
+            if session.result is not None or session.id not in self.sessions:
+                return
+            session.engine_task = None
+            self.end_session(session, '*', 'engine error')
+            await session.connection.send(dict(session.to_dict(), event='error', error='engine error: %r' % error))
+            return
+        if session.result is not None or session.id not in self.sessions:
+            return
+        session.engine_task = None
+        move = session.gs.get_move_from_notation(notation, session.valid_moves)
+        self.play(session, move)
+        event = dict(session.to_dict(), event='move', move=notation)
+        await session.connection.send(event)
+        if session.result is not None:
+            await session.connection.send(dict(session.to_dict(), event='end', reason=session.reason))
+
+
+class GameClient:
+    '''
+    Minimal client for scripts and local testing of the server
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8765):
+        reader, writer = await asyncio.open_connection(host, port, limit=MAX_LINE)
+        return cls(reader, writer)
+
+    async def send(self, op, **fields):
+        self.writer.write(json.dumps(dict(fields, op=op)).encode() + b'\n')
+        await self.writer.drain()
+
+    async def receive(self):
+        line = await self.reader.readline()
+        return json.loads(line) if line else None
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def serve(host, port, **options):
+    game_server = GameServer(**options)
+    server = await game_server.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await game_server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host many chess games over TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-sessions', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=None, help='engine processes, defaults to one per CPU')
+    parser.add_argument('--depth', type=int, default=Chess_AI.MAX_DEPTH)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, max_sessions=args.max_sessions, workers=args.workers,
+                      engine_depth=args.depth))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+This file lets the engine play in any UCI GUI (Arena, Cute Chess, ...) over stdin/stdout. It:
+ - keeps one Engine per game, so the transposition table and history heuristic carry over between moves
+ - ponders: 'go ponder' searches the position after the reply we expect while the opponent thinks, and
+   'ponderhit' turns that same search into the timed one instead of starting over
+"""
+
+import sys
+import threading
+import time
+
+from Chess import Chess_AI, Chess_Logic
+
+NAME = 'Chess_AI'
+AUTHOR = 'romanmikh'
+MAX_SEARCH_DEPTH = 64  # timed and infinite searches deepen until they are stopped
+MOVES_TO_GO = 30  # spend 1/30 of the clock when the GUI doesn't say how many moves are left
+
+
+class UCI:
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.output_lock = threading.Lock()
+        self.engine = Chess_AI.Engine()
+        self.gs = Chess_Logic.GameState()
+        self.search_thread = None
+        self.limits = None
+        self.ponder_time = None  # time budget to start from once the ponder move is played, None for no limit
+        self.may_answer = threading.Event()  # cleared while a 'go ponder' or 'go infinite' waits for ponderhit/stop
+
+    def send(self, line):
+        with self.output_lock:
+            self.out.write(line + '\n')
+            self.out.flush()
+
+    def run(self, lines=sys.stdin):
+        for line in lines:
+            if not self.handle(line.split()):
+                break
+        self.stop()
+
+    def handle(self, words):
+        '''
+        Act on one command. Returns False on 'quit'. Bad input is reported with 'info string' rather than ending the
+        engine
+        '''
+        try:
+            return self.handle_command(words)
+        except (ValueError, IndexError) as error:
+            self.send('info string error in %s: %s' % (' '.join(words), error))
+            return True
+
+    def handle_command(self, words):
+        if not words:
+            return True
+        command = words[0]
+        if command == 'uci':
+            self.send('id name ' + NAME)
+            self.send('id author ' + AUTHOR)
+            self.send('option name Ponder type check default true')
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'ucinewgame':
+            self.stop()
+            self.engine.new_game()
+        elif command == 'position':
+            self.stop()
+            self.set_position(words[1:])
+        elif command == 'go':
+            self.stop()
+            self.go(words[1:])
+        elif command == 'ponderhit':
+            self.ponderhit()
+        elif command == 'stop':
+            self.stop()
+        elif command == 'quit':
+            return False
+        return True
+
+    def set_position(self, words):
+        gs = Chess_Logic.GameState()
+        if words and words[0] == 'fen':
+            end = words.index('moves') if 'moves' in words else len(words)
+            gs.load_fen(' '.join(words[1:end]))
+            words = words[end:]
+        elif words and words[0] == 'startpos':
+            words = words[1:]
+        for notation in words[1:] if words and words[0] == 'moves' else []:
+            move = gs.get_move_from_notation(notation)
+            if move is None:
+                self.send('info string illegal move ' + notation)
+                break
+            gs.make_move(move)
+        self.gs = gs
+
+    def go(self, words):
+        options = {}
+        for i in range(len(words)):
+            if words[i] in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+                try:
+                    options[words[i]] = int(words[i + 1])
+                except (ValueError, IndexError):  # still search, a GUI waits for bestmove after every go
+                    self.send('info string ignoring %s without a number' % words[i])
+        for name in ('wtime', 'btime', 'winc', 'binc', 'movetime'):  # GUIs send negative times once a clock is out
+            if name in options:
+                options[name] = max(0, options[name])
+        if options.get('movestogo', 1) < 1:
+            del options['movestogo']
+        if options.get('depth', 1) < 1:
+            del options['depth']
+        max_depth = options.get('depth', MAX_SEARCH_DEPTH)
+        time_limit = None
+        if 'movetime' in options:
+            time_limit = options['movetime'] / 1000
+        else:
+            side = 'w' if self.gs.white_to_move else 'b'
+            if side + 'time' in options:
+                moves_to_go = options.get('movestogo', MOVES_TO_GO)
+                time_limit = (options[side + 'time'] / moves_to_go + options.get(side + 'inc', 0)) / 1000
+        if time_limit is None and 'depth' not in options and 'nodes' not in options and 'infinite' not in words \
+                and 'ponder' not in words:
+            max_depth = Chess_AI.MAX_DEPTH  # a bare 'go'
+        self.limits = Chess_AI.SearchLimits(None, options.get('nodes'))
+        self.ponder_time = None
+        if 'ponder' in words:
+            self.ponder_time = time_limit  # the clock only starts at ponderhit
+        elif time_limit is not None:
+            self.limits.deadline = time.perf_counter() + time_limit
+        if 'ponder' in words or 'infinite' in words:  # no bestmove until ponderhit or stop
+            self.may_answer.clear()
+        else:
+            self.may_answer.set()
+        self.search_thread = threading.Thread(target=self.search, args=(self.gs, self.limits, max_depth),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def ponderhit(self):
+        '''
+        The opponent played the move we pondered on: keep searching, now against our own clock
+        '''
+        if self.limits is not None and self.ponder_time is not None:
+            self.limits.deadline = time.perf_counter() + self.ponder_time
+        self.may_answer.set()
+
+    def stop(self):
+        if self.search_thread is not None:
+            self.limits.stop()
+            self.may_answer.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+    def search(self, gs, limits, max_depth):
+        valid_moves = gs.get_valid_moves()
+        start = time.perf_counter()
+
+        def report(analysis):
+            if len(analysis['pvs']) == 0:  # no legal moves
+                return
+            elapsed = time.perf_counter() - start
+            self.send('info depth %d score %s nodes %d nps %d time %d pv %s' % (
+                analysis['depth'], format_score(analysis['scores'][0], analysis['pvs'][0]), analysis['nodes'],
+                analysis['nodes'] / elapsed if elapsed > 0 else 0, elapsed * 1000,
+                ' '.join(move.get_coordinate_notation() for move in analysis['pvs'][0])))
+
+        analysis = self.engine.analyse(gs, valid_moves, 1, max_depth, limits=limits, report=report)
+        self.may_answer.wait()  # a search that finished while pondering still waits for ponderhit or stop
+        if len(valid_moves) == 0:
+            pv = []
+        elif analysis['depth'] == 0 or len(analysis['pvs']) == 0:  # stopped before depth 1 finished
+            pv = [Chess_AI.find_random_move(valid_moves)]
+        else:
+            pv = analysis['pvs'][0]
+        if len(pv) == 0:
+            self.send('bestmove 0000')
+        elif len(pv) == 1:
+            self.send('bestmove ' + pv[0].get_coordinate_notation())
+        else:
+            self.send('bestmove %s ponder %s' % (pv[0].get_coordinate_notation(), pv[1].get_coordinate_notation()))
+
+
+def format_score(score, pv):
+    if abs(score) >= Chess_AI.CHECKMATE:
+        return 'mate %d' % ((len(pv) + 1) // 2 if score > 0 else -(len(pv) // 2))
+    return 'cp %d' % (score * 100)
+
+
+def main():
+    UCI().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+import types
+
+# the modules import each other from the Chess package (this directory), make that work whatever the checkout is called
+if 'Chess' not in sys.modules:
+    package = types.ModuleType('Chess')
+    package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+    sys.modules['Chess'] = package
@@ -0,0 +1,77 @@
+import pytest
+
+import Chess_Logic
+
+
+def valid_notations(fen):
+    gs = Chess_Logic.GameState()
+    gs.load_fen(fen)
+    return {move.get_coordinate_notation() for move in gs.get_valid_moves()}
+
+
+def test_en_passant_exposing_king_along_rank():
+    assert 'b5c6' not in valid_notations('8/8/8/KPp4r/8/8/8/7k w - c6 0 1')
+
+
+def test_en_passant_uncovering_diagonal_check():
+    assert 'e5d6' not in valid_notations('4k3/5b2/8/3pP3/8/1K6/8/8 w - d6 0 2')
+
+
+def test_en_passant_allowed_when_safe():
+    assert 'e5d6' in valid_notations('4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 2')
+
+
+def test_load_fen_rejects_missing_king_on_reused_state():
+    gs = Chess_Logic.GameState()
+    gs.load_fen('4k3/8/8/8/8/8/8/4K2R w K - 0 1')
+    with pytest.raises(ValueError, match='invalid FEN'):
+        gs.load_fen('4k3/8/8/8/8/8/8/7R w - - 0 1')
+    assert gs.get_fen() == '4k3/8/8/8/8/8/8/4K2R w K - 0 1'
+
+
+@pytest.mark.parametrize('fen', ['4k3/8/8/8/8/8/8/4K3 w - z9 0 1', '4k3/8/8/8/8/8/8/3KK3 w - - 0 1',
+                                 '4k3/8/8/8/8/8/8/4K3 w - - x 1', '4k3/8/8/8/8/8/3P4/4K3 w - e3 0 1',
+                                 '4k3/8/8/8/8/8/3P4/4K3 b - e3 0 1', '4k3/8/8/8/8/8/8/P3K3 w - - 0 1',
+                                 'p3k3/8/8/8/8/8/8/4K3 b - - 0 1'])
+def test_load_fen_rejects_bad_fields(fen):
+    with pytest.raises(ValueError, match='invalid FEN'):
+        Chess_Logic.GameState().load_fen(fen)
+
+
+def test_load_fen_drops_castling_rights_without_king_and_rook_at_home():
+    gs = Chess_Logic.GameState()
+    gs.load_fen('4k3/8/8/8/8/8/8/4K3 w KQkq - 0 1')
+    assert gs.get_fen() == '4k3/8/8/8/8/8/8/4K3 w - - 0 1'
+    assert not {'e1g1', 'e1c1'} & valid_notations('4k3/8/8/8/8/8/8/4K3 w KQkq - 0 1')
+    assert {'e1g1', 'e1c1'} <= valid_notations('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+
+
+def perft(gs, depth):
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+
+def perft_from(fen, depth):
+    gs = Chess_Logic.GameState()
+    gs.load_fen(fen)
+    return perft(gs, depth)
+
+
+# known counts; none of these depths reach a promotion, so queen-only promotion doesn't matter
+def test_perft_start_position():
+    assert perft(Chess_Logic.GameState(), 4) == 197281
+
+
+def test_perft_kiwipete():
+    assert perft_from('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 3) == 97862
+
+
+def test_perft_position_3():
+    assert perft_from('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 5) == 674624
@@ -0,0 +1,31 @@
+import pytest
+
+from Chess import Chess_Logic, Chess_Mate
+
+
+@pytest.mark.parametrize('fen, mate_in', [
+    ('6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1', 1),  # back rank
+    ('k7/8/1K6/8/8/8/8/6R1 w - - 0 1', 1),
+    ('7k/8/8/8/8/8/R7/1R4K1 w - - 0 1', 2),  # rook roller
+    ('k7/8/2K5/8/8/8/8/7R w - - 0 1', 2),
+    ('r1b1kb1r/pppp1ppp/5q2/4n3/3KP3/2N3PN/PPP4P/R1BQ1B1R b kq - 0 1', 3),  # black mates the exposed king
+])
+def test_finds_shortest_mate(fen, mate_in):
+    gs = Chess_Logic.GameState()
+    gs.load_fen(fen)
+    result = Chess_Mate.solve_mate(gs, 3)
+    assert result['result'] == 'mate' and result['mate_in'] == mate_in
+    assert len(result['line']) == 2 * mate_in - 1
+    assert gs.get_fen() == fen  # the search leaves the position as it was given
+    for notation in result['line']:
+        move = gs.get_move_from_notation(notation)
+        assert move is not None
+        gs.make_move(move)
+    gs.get_valid_moves()
+    assert gs.checkmate
+
+
+@pytest.mark.parametrize('fen', ['4k3/8/8/8/8/8/8/4K3 w - - 0 1', '8/8/8/8/8/k7/8/1K5R w - - 0 1'])
+def test_no_mate_within_limit(fen):
+    result = Chess_Mate.solve_fen(fen, 3)
+    assert result['result'] == 'no mate' and result['mate_in'] is None and result['line'] == []
@@ -0,0 +1,106 @@
+import asyncio
+
+from Chess import Chess_Server
+
+
+def run_with_server(test):
+    '''
+    Run test(game_server, client) against a server on a free local port, with a small, fast engine
+    '''
+    async def main():
+        game_server = Chess_Server.GameServer(workers=1, engine_depth=1, engine_time=0.1)
+        server = await game_server.start(port=0)
+        client = await Chess_Server.GameClient.connect(port=server.sockets[0].getsockname()[1])
+        try:
+            await test(game_server, client)
+        finally:
+            await client.close()
+            await game_server.close()
+
+    asyncio.run(asyncio.wait_for(main(), 30))
+
+
+def test_moves_and_engine_reply():
+    async def test(game_server, client):
+        await client.send('new', white='human', black='engine', id=1)
+        reply = await client.receive()
+        assert reply['event'] == 'new' and reply['id'] == 1 and reply['to_move'] == 'w'
+        await client.send('move', game=reply['game'], move='e2e4')
+        reply = await client.receive()
+        assert reply['event'] == 'move' and reply['moves'] == ['e2e4']
+        reply = await client.receive()  # the engine's answer
+        assert reply['event'] == 'move' and len(reply['moves']) == 2 and reply['to_move'] == 'w'
+        await client.send('move', game=reply['game'], move='e2e4')  # the pawn isn't there anymore
+        reply = await client.receive()
+        assert reply['event'] == 'error' and reply['error'] == 'illegal move'
+
+    run_with_server(test)
+
+
+def test_engine_moves_first_as_white():
+    async def test(game_server, client):
+        await client.send('new', white='engine', black='human')
+        assert (await client.receive())['event'] == 'new'
+        reply = await client.receive()
+        assert reply['event'] == 'move' and len(reply['moves']) == 1 and reply['to_move'] == 'b'
+
+    run_with_server(test)
+
+
+def test_checkmate_by_a_human_move_sends_end():
+    async def test(game_server, client):
+        await client.send('new', white='human', black='human')
+        game = (await client.receive())['game']
+        for notation in ('f2f3', 'e7e5', 'g2g4', 'd8h4'):
+            await client.send('move', game=game, move=notation)
+            assert (await client.receive())['event'] == 'move'
+        reply = await client.receive()
+        assert reply['event'] == 'end' and reply['reason'] == 'checkmate' and reply['result'] == '0-1'
+
+    run_with_server(test)
+
+
+def test_flag():
+    async def test(game_server, client):
+        await client.send('new', white='human', black='engine', time=0.2)
+        assert (await client.receive())['event'] == 'new'
+        reply = await client.receive()
+        assert reply['event'] == 'end' and reply['reason'] == 'time' and reply['result'] == '0-1'
+
+    run_with_server(test)
+
+
+def test_bad_messages_get_errors():
+    async def test(game_server, client):
+        for line in (b'[1, 2]\n', b'not json\n', b'{"op": "state", "game": [1]}\n', b'{"op": "new", "time": "x"}\n'):
+            client.writer.write(line)
+            assert (await client.receive())['event'] == 'error'
+
+    run_with_server(test)
+
+
+def test_disconnect_closes_sessions():
+    async def test(game_server, client):
+        await client.send('new', white='human', black='engine', time=60)
+        assert (await client.receive())['event'] == 'new'
+        await client.send('new', white='engine', black='engine', time=60)
+        assert (await client.receive())['event'] == 'new'
+        assert (await client.receive())['event'] == 'move'  # searches have run in the workers
+        assert len(game_server.sessions) == 2
+        await client.close()
+        for _ in range(100):
+            if not game_server.sessions:
+                break
+            await asyncio.sleep(0.01)
+        assert not game_server.sessions
+
+    run_with_server(test)
+
+
+def test_engine_kept_per_session_until_forgotten():
+    first = Chess_Server.engine_search(-1, [], 1, None)
+    engine = Chess_Server.worker_engines[-1]
+    Chess_Server.engine_search(-1, [first, 'e7e5'], 1, None)
+    assert Chess_Server.worker_engines[-1] is engine and engine.game[0] == first
+    Chess_Server.forget_session(-1)
+    assert -1 not in Chess_Server.worker_engines
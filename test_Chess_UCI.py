@@ -0,0 +1,22 @@
+import io
+
+from Chess import Chess_UCI
+
+
+def run_commands(*lines):
+    out = io.StringIO()
+    Chess_UCI.UCI(out).run(list(lines) + ['quit'])
+    return out.getvalue().splitlines()
+
+
+def test_bad_input_is_reported_not_fatal():
+    output = run_commands('position fen 8/8/8 w', 'go depth', 'isready')
+    assert output[0].startswith('info string') and 'invalid FEN' in output[0]
+    assert output[1] == 'info string ignoring depth without a number'
+    assert any(line.startswith('bestmove ') for line in output)
+    assert 'readyok' in output
+
+
+def test_negative_clock_still_answers():
+    output = run_commands('position startpos', 'go wtime -500 btime 1000')
+    assert output[-1].startswith('bestmove ') and output[-1] != 'bestmove 0000'